@@ -1,19 +1,22 @@
+import logging
 import os
-from flask import Flask, jsonify, request
+from flask import Flask, request
 from dotenv import load_dotenv
 import structlog
 from datetime import datetime
 from bson import ObjectId
 from bson.errors import InvalidId
-from pymongo.errors import DuplicateKeyError
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from flask_swagger_ui import get_swaggerui_blueprint
 
 load_dotenv()
 
-from db import get_db, close_db
+from db import get_db, close_db, get_customers_durable, get_customers_fast
 from logger_config import setup_logging
 from errors import register_error_handlers, ApiError
-from utils import MongoJSONProvider
+from schemas import validate, validate_address, validate_customer
+from utils import MongoJSONProvider, dumps_bytes, json_response, with_object_id
 from prometheus_flask_exporter import PrometheusMetrics
 
 
@@ -27,7 +30,51 @@ app.json = app.json_provider_class(app)
 register_error_handlers(app)
 log = structlog.get_logger()
 
-metrics = PrometheusMetrics(app)
+# Label by endpoint rather than raw path so ids in URLs don't create a new
+# series per customer/address, and keep probe/docs traffic out of the metrics.
+metrics = PrometheusMetrics(
+    app,
+    group_by='endpoint',
+    default_labels={'service': 'customer-service'},
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+    excluded_paths=['^/healthz$', '^/metrics$', '^/docs', '^/static/']
+)
+metrics.info('app_info', 'Customer service info', version='1.0.0')
+
+# Top-level customer fields other than addresses; excluded when only the
+# embedded addresses are needed ($slice projections are exclusion-style)
+CUSTOMER_FIELDS = ("_id", "name", "email", "email_lower", "phone", "created_at")
+
+# Stored for lookups only; never returned to clients
+INTERNAL_FIELDS = frozenset({"email_lower"})
+
+# Fields returned by the customer list view when ?fields= is not given
+LIST_FIELDS = ("name", "email", "phone", "created_at")
+# Fields a client may ask for with ?fields=
+SELECTABLE_FIELDS = frozenset(LIST_FIELDS) | {"_id", "addresses"}
+
+# Projection expression that stringifies embedded address ids on the server,
+# so responses serialize without per-value Python fallbacks.
+ADDRESSES_AS_JSON = {
+    "$map": {
+        "input": {"$ifNull": ["$addresses", []]},
+        "in": {"$mergeObjects": ["$$this", {"_id": {"$toString": "$$this._id"}}]}
+    }
+}
+
+# Largest page size list_customers accepts
+MAX_LIST_LIMIT = 100
+
+# Documents fetched per cursor batch while streaming the customer list
+LIST_BATCH_SIZE = 50
+
+# Max customers per insert_many call in the batch endpoint
+CUSTOMER_BATCH_SIZE = int(os.environ.get('CUSTOMER_BATCH_SIZE', 50))
+if CUSTOMER_BATCH_SIZE < 1:
+    raise ValueError("CUSTOMER_BATCH_SIZE must be at least 1")
+
+# Max items accepted by the batch endpoints in one request
+MAX_BATCH_ITEMS = 500
 
 SWAGGER_URL = '/docs'
 API_URL = '/static/customer_service_openapi.yaml'
@@ -41,21 +88,33 @@ swaggerui_blueprint = get_swaggerui_blueprint(
 )
 app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
+# Probe and scrape paths hit far more often than real traffic; don't log them
+UNLOGGED_PATHS = frozenset({'/healthz', '/metrics'})
+
 @app.before_request
 def before_request():
+    # Always reset, so probes don't inherit the previous request's context
+    structlog.contextvars.clear_contextvars()
+    if request.path in UNLOGGED_PATHS:
+        return
     # Bind correlation ID to logger context for this request
     correlation_id = request.headers.get('X-Correlation-Id')
-    structlog.contextvars.clear_contextvars()
     structlog.contextvars.bind_contextvars(
         correlation_id=correlation_id,
         path=request.path,
         method=request.method
     )
-    log.info("request_started", request_body=request.get_json(silent=True))
+    # Only parse and log the body when it will actually be emitted
+    if app.debug or log.isEnabledFor(logging.DEBUG):
+        log.info("request_started", request_body=request.get_json(silent=True))
+    else:
+        log.info("request_started")
 
 
 @app.after_request
 def after_request(response):
+    if request.path in UNLOGGED_PATHS:
+        return response
     log.info("request_finished", status_code=response.status_code)
     return response
 
@@ -70,147 +129,325 @@ def teardown_db(exception):
 @app.route('/healthz', methods=['GET'])
 def health_check():
     """Health probe for Kubernetes."""
-    return jsonify({"status": "ok", "service": "customer-service"}), 200
+    return json_response({"status": "ok", "service": "customer-service"})
 
 
 
-@app.route('/v1/customers', methods=['POST'])
-def create_customer():
-    data = request.get_json()
-    if not data or not 'name' in data or not 'email' in data or not 'phone' in data:
-        raise ApiError("Name, email, and phone are required", 400, "BAD_REQUEST")
+def build_customer_doc(data):
+    """Validates a customer payload and builds the document to insert."""
+    validate(validate_customer, data)
 
-    db = get_db()
+    # BSON dates have millisecond precision; truncate so the echoed
+    # created_at matches what a later read returns.
+    now = datetime.utcnow()
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
 
-    new_customer_doc = {
+    return {
         "name": data['name'],
         "email": data['email'],
+        "email_lower": data['email'].strip().lower(),
         "phone": data['phone'],
         "addresses": [],
-        "created_at": datetime.utcnow()
+        "created_at": now
     }
 
+
+def public_customer(doc):
+    """Drops internal lookup fields from a customer document before it is returned."""
+    return {k: v for k, v in doc.items() if k not in INTERNAL_FIELDS}
+
+
+def build_address_doc(data):
+    """
+    Validates an address payload and builds the embedded subdocument.
+    created_at is stamped by MongoDB in push_addresses.
+    """
+    validate(validate_address, data)
+
+    return {
+        "_id": ObjectId(),
+        "line1": data['line1'],
+        "area": data.get('area'),
+        "city": data['city'],
+        "pincode": data['pincode']
+    }
+
+
+def push_addresses(customer_id, new_addresses):
+    """
+    Appends addresses to a customer in one atomic update, stamping
+    created_at with the server clock ($$NOW), and returns the stored
+    addresses.
+    """
+    customers = get_customers_fast()
+
+    # $literal keeps user-supplied values starting with '$' from
+    # being evaluated as field paths inside the pipeline.
+    stamped = [
+        {"$mergeObjects": [{"$literal": address}, {"created_at": "$$NOW"}]}
+        for address in new_addresses
+    ]
+    customer = customers.find_one_and_update(
+        {"_id": customer_id},
+        [{"$set": {"addresses": {"$concatArrays": [{"$ifNull": ["$addresses", []]}, stamped]}}}],
+        projection=dict.fromkeys(CUSTOMER_FIELDS, 0) | {"addresses": {"$slice": -len(new_addresses)}},
+        return_document=ReturnDocument.AFTER
+    )
+
+    if not customer:
+        raise ApiError("Customer not found", 404, "NOT_FOUND")
+
+    return customer['addresses']
+
+
+def get_json_array():
+    """Returns the request body, which must be a non-empty JSON array."""
+    data = request.get_json()
+    if not isinstance(data, list) or len(data) == 0:
+        raise ApiError("Request body must be a non-empty JSON array", 400, "BAD_REQUEST")
+    if len(data) > MAX_BATCH_ITEMS:
+        raise ApiError(f"At most {MAX_BATCH_ITEMS} items are allowed per request", 400, "BAD_REQUEST")
+    return data
+
+
+def build_batch(build, items):
+    """Builds a document per item, prefixing validation errors with the item index."""
+    docs = []
+    for index, item in enumerate(items):
+        try:
+            docs.append(build(item))
+        except ApiError as e:
+            raise ApiError(f"Item {index}: {e.message}", e.status_code, e.code)
+    return docs
+
+
+@app.route('/v1/customers', methods=['POST'])
+def create_customer():
+    new_customer_doc = build_customer_doc(request.get_json())
+
+    customers = get_customers_durable()
+
     try:
-        result = db.customers.insert_one(new_customer_doc)
-        new_customer = db.customers.find_one({"_id": result.inserted_id})
-        return jsonify(new_customer), 201
+        result = customers.insert_one(new_customer_doc)
+        # Echo the inserted document instead of reading it back
+        new_customer_doc["_id"] = result.inserted_id
+        return json_response(public_customer(new_customer_doc), 201)
 
     except DuplicateKeyError:
-        raise ApiError("Email or phone already exists. (Have you created unique indexes?)", 409, "CONFLICT")
+        raise ApiError("Email or phone already exists", 409, "CONFLICT")
     except Exception as e:
         raise ApiError(str(e), 500, "DATABASE_ERROR")
 
 
+@app.route('/v1/customers:batch', methods=['POST'])
+def create_customers_batch():
+    """
+    Bulk-creates customers with unordered insert_many calls.
+    Duplicates are reported per item and the rest are still created.
+    Any other database error stops the batch; the response then lists
+    what was created and which items could not be confirmed.
+    """
+    docs = build_batch(build_customer_doc, get_json_array())
+
+    customers = get_customers_durable()
+
+    created = []
+    errors = []
+    for start in range(0, len(docs), CUSTOMER_BATCH_SIZE):
+        chunk = docs[start:start + CUSTOMER_BATCH_SIZE]
+        failed = set()
+        stop = False
+        try:
+            customers.insert_many(chunk, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get('writeErrors', []):
+                failed.add(write_error['index'])
+                if write_error.get('code') == 11000:
+                    errors.append({
+                        "index": start + write_error['index'],
+                        "code": "CONFLICT",
+                        "message": "Email or phone already exists"
+                    })
+                else:
+                    stop = True
+                    errors.append({
+                        "index": start + write_error['index'],
+                        "code": "DATABASE_ERROR",
+                        "message": write_error.get('errmsg', str(e))
+                    })
+            if e.details.get('writeConcernErrors'):
+                # The rest of the chunk was written on the primary but the
+                # write concern wasn't met, so it isn't confirmed durable.
+                log.error("customer_batch_write_concern_failed", created=len(created))
+                stop = True
+                unconfirmed = set(range(len(chunk))) - failed
+                failed |= unconfirmed
+                errors.extend({
+                    "index": start + i,
+                    "code": "DATABASE_ERROR",
+                    "message": "Not confirmed; the write concern was not satisfied"
+                } for i in sorted(unconfirmed))
+        except Exception as e:
+            # Unknown which documents of this chunk were written
+            log.error("customer_batch_failed", error=str(e), created=len(created))
+            stop = True
+            failed = set(range(len(chunk)))
+            errors.extend({
+                "index": start + i,
+                "code": "DATABASE_ERROR",
+                "message": "Not confirmed; the batch stopped after a database error"
+            } for i in failed)
+        created.extend(public_customer(doc) for i, doc in enumerate(chunk) if i not in failed)
+        if stop:
+            errors.extend({
+                "index": index,
+                "code": "NOT_ATTEMPTED",
+                "message": "The batch stopped after a database error"
+            } for index in range(start + len(chunk), len(docs)))
+            break
+
+    if created:
+        status = 201
+    elif all(error["code"] == "CONFLICT" for error in errors):
+        status = 409
+    else:
+        status = 500
+    return json_response({"data": created, "errors": errors}, status)
+
+
 @app.route('/v1/customers', methods=['GET'])
 def list_customers():
-    # Supports pagination and filtering
+    # Supports keyset pagination on _id and filtering.
+    # `page` is deprecated; use the `next_cursor` of the previous page as `after`.
+    after = request.args.get('after')
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 20, type=int)
     email = request.args.get('email')
-    offset = (page - 1) * limit
+    fields = request.args.get('fields')
+
+    if not 1 <= limit <= MAX_LIST_LIMIT:
+        raise ApiError(f"limit must be between 1 and {MAX_LIST_LIMIT}", 400, "BAD_REQUEST")
+
+    # List view drops the embedded addresses unless fields are requested
+    if fields:
+        requested = {f.strip() for f in fields.split(',') if f.strip()}
+        unknown = requested - SELECTABLE_FIELDS
+        if unknown:
+            raise ApiError(f"Unknown fields: {', '.join(sorted(unknown))}", 400, "BAD_REQUEST")
+        projection = dict.fromkeys(requested, 1)
+        if "addresses" in projection:
+            projection["addresses"] = ADDRESSES_AS_JSON
+    else:
+        projection = dict.fromkeys(LIST_FIELDS, 1)
+    # Convert _id on the server so decoded docs hold only JSON-native types
+    projection["_id"] = {"$toString": "$_id"}
 
     db = get_db()
     query = {}
     if email:
-        # Case-insensitive search
-        query['email'] = {"$regex": email, "$options": "i"}
-
-    customers = list(db.customers.find(query).skip(offset).limit(limit))
-
-    return jsonify({
-        "page": page,
-        "limit": limit,
-        "data": customers
-    }), 200
+        # Case-insensitive match on the indexed, normalized email
+        query['email_lower'] = email.strip().lower()
+
+    if after:
+        try:
+            query['_id'] = {"$gt": ObjectId(after)}
+        except InvalidId:
+            raise ApiError("Invalid after cursor format", 400, "BAD_REQUEST")
+
+    cursor = db.customers.find(query, projection).sort("_id", 1)
+    if not after and page > 1:
+        cursor = cursor.skip((page - 1) * limit)
+
+    meta = {"limit": limit}
+    if not after:
+        meta["page"] = page
+    cursor = cursor.limit(limit).batch_size(LIST_BATCH_SIZE)
+    # Cursors are lazy: pull the first document here so query errors still
+    # reach the error handlers instead of breaking an already-started 200.
+    first = next(cursor, None)
+    return app.response_class(stream_customer_page(meta, first, cursor, limit), mimetype='application/json')
+
+
+def stream_customer_page(meta, first, cursor, limit):
+    """
+    Yields the list_customers response body one document at a time,
+    so only the current document is held in memory. next_cursor is
+    written after data since it depends on the last document.
+    """
+    yield dumps_bytes(meta)[:-1] + b',"data":['
+    if first is None:
+        yield b'],"next_cursor":null}'
+        return
+    yield dumps_bytes(first)
+    count = 1
+    last_id = first["_id"]
+    for customer in cursor:
+        yield b',' + dumps_bytes(customer)
+        count += 1
+        last_id = customer["_id"]
+    next_cursor = last_id if count == limit else None
+    yield b'],"next_cursor":' + dumps_bytes(next_cursor) + b'}'
 
 
 @app.route('/v1/customers/<customer_id>', methods=['GET'])
+@with_object_id('customer_id')
 def get_customer_by_id(customer_id):
     db = get_db()
-    try:
-        obj_id = ObjectId(customer_id)
-    except InvalidId:
-        raise ApiError("Invalid customer_id format", 400, "BAD_REQUEST")
-
-    customer = db.customers.find_one({"_id": obj_id})
+    customer = db.customers.find_one({"_id": customer_id}, {"email_lower": 0})
     if not customer:
         raise ApiError("Customer not found", 404, "NOT_FOUND")
 
-    return jsonify(customer), 200
+    return json_response(customer)
 
 
 
 @app.route('/v1/customers/<customer_id>/addresses', methods=['POST'])
+@with_object_id('customer_id')
 def create_address(customer_id):
-    try:
-        customer_obj_id = ObjectId(customer_id)
-    except InvalidId:
-        raise ApiError("Invalid customer_id format", 400, "BAD_REQUEST")
+    new_address = build_address_doc(request.get_json())
 
-    data = request.get_json()
-    if not data or not 'line1' in data or not 'city' in data or not 'pincode' in data:
-        raise ApiError("line1, city, and pincode are required", 400, "BAD_REQUEST")
+    return json_response(push_addresses(customer_id, [new_address])[0], 201)
 
-    db = get_db()
 
-    new_address = {
-        "_id": ObjectId(),
-        "line1": data['line1'],
-        "area": data.get('area'),
-        "city": data['city'],
-        "pincode": data['pincode'],
-        "created_at": datetime.utcnow()
-    }
+@app.route('/v1/customers/<customer_id>/addresses:batch', methods=['POST'])
+@with_object_id('customer_id')
+def create_addresses_batch(customer_id):
+    """Adds several addresses to a customer in a single update."""
+    new_addresses = build_batch(build_address_doc, get_json_array())
 
-    result = db.customers.update_one(
-        {"_id": customer_obj_id},
-        {"$push": {"addresses": new_address}}
-    )
-
-    if result.matched_count == 0:
-        raise ApiError("Customer not found", 404, "NOT_FOUND")
-
-    return jsonify(new_address), 201
+    return json_response(push_addresses(customer_id, new_addresses), 201)
 
 
 @app.route('/v1/customers/<customer_id>/addresses', methods=['GET'])
+@with_object_id('customer_id')
 def list_addresses_for_customer(customer_id):
-    try:
-        customer_obj_id = ObjectId(customer_id)
-    except InvalidId:
-        raise ApiError("Invalid customer_id format", 400, "BAD_REQUEST")
-
     db = get_db()
     customer = db.customers.find_one(
-        {"_id": customer_obj_id},
-        {"addresses": 1, "_id": 0}
+        {"_id": customer_id},
+        {"_id": 0, "addresses": ADDRESSES_AS_JSON}
     )
 
     if not customer:
         raise ApiError("Customer not found", 404, "NOT_FOUND")
 
-    return jsonify(customer.get('addresses', [])), 200
+    return json_response(customer.get('addresses', []))
 
 
 @app.route('/v1/addresses/<address_id>', methods=['GET'])
+@with_object_id('address_id')
 def get_address_by_id(address_id):
     """Internal-facing endpoint for other services."""
-    try:
-        address_obj_id = ObjectId(address_id)
-    except InvalidId:
-        raise ApiError("Invalid address_id format", 400, "BAD_REQUEST")
-
     db = get_db()
 
     customer = db.customers.find_one(
-        {"addresses._id": address_obj_id},
+        {"addresses._id": address_id},
         {"_id": 0, "addresses.$": 1}
     )
 
     if not customer or 'addresses' not in customer or len(customer['addresses']) == 0:
         raise ApiError("Address not found", 404, "NOT_FOUND")
 
-    return jsonify(customer['addresses'][0]), 200
+    return json_response(customer['addresses'][0])
 
 
 if __name__ == '__main__':
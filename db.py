@@ -1,37 +1,150 @@
 import os
-import sys
-from pymongo import MongoClient
-from flask import g
+import threading
+import structlog
+from pymongo import MongoClient, WriteConcern
+from pymongo.errors import OperationFailure
+
+log = structlog.get_logger()
+
+# Acknowledged by the primary without waiting for the journal; for data
+# that is cheap to re-send (e.g. addresses).
+FAST_WRITE_CONCERN = WriteConcern(w=1, j=False)
+# Acknowledged once a majority of the replica set has the write.
+DURABLE_WRITE_CONCERN = WriteConcern(w="majority")
 
 client = None
+_db = None
+_customers_fast = None
+_customers_durable = None
+_indexes_created = False
+_init_lock = threading.Lock()
 
 def get_db_client():
     """
-    Initializes and returns a global MongoDB client.
+    Initializes and returns a global MongoDB client, along with the
+    cached database and collection handles used by the getters below.
+    The globals are only published once the ping and index build have
+    succeeded, so concurrent requests never see a half-initialized
+    client, and a failed attempt is retried on the next call.
     """
-    global client
-    if client is None:
+    global client, _db, _customers_fast, _customers_durable
+    if _db is not None:
+        return client
+    with _init_lock:
+        if _db is not None:
+            return client
+        new_client = None
         try:
             # Get URI from env, default to localhost
             uri = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
-            client = MongoClient(uri)
+            new_client = MongoClient(
+                uri,
+                maxPoolSize=int(os.environ.get('MONGO_MAX_POOL', 100)),
+                minPoolSize=int(os.environ.get('MONGO_MIN_POOL', 10)),
+                retryWrites=True,
+                uuidRepresentation='standard',
+                # Wire compression, negotiated with the server in this order
+                compressors=os.environ.get('MONGO_COMPRESSORS', 'zstd,snappy,zlib'),
+                zlibCompressionLevel=-1
+            )
             # Ping the server to test the connection
-            client.admin.command('ping')
-            print("MongoDB connection successful.")
+            new_client.admin.command('ping')
+            db = new_client[os.environ.get('DB_NAME', 'customer_db')]
+            # The URI may carry credentials, so only the db name is logged
+            log.info("mongo_connected", db_name=db.name)
         except Exception as e:
-            print(f"Failed to connect to MongoDB: {e}", file=sys.stderr)
-            sys.exit(1) # Exit if DB connection fails
+            if new_client is not None:
+                new_client.close()
+            log.critical("mongo_connect_failed", error=str(e))
+            raise SystemExit(1) # Exit if DB connection fails
+        try:
+            ensure_indexes(db)
+        except Exception as e:
+            new_client.close()
+            log.critical("index_creation_failed", error=str(e))
+            raise SystemExit(1) # Handlers rely on the unique indexes
+        client = new_client
+        _customers_fast = db.customers.with_options(write_concern=FAST_WRITE_CONCERN)
+        _customers_durable = db.customers.with_options(write_concern=DURABLE_WRITE_CONCERN)
+        # Published last: the fast path above only checks _db
+        _db = db
     return client
 
+def ensure_indexes(db):
+    """
+    Creates the indexes the request handlers rely on.
+    Runs once per process; create_index is a no-op when the
+    index already exists.
+    """
+    global _indexes_created
+    if _indexes_created:
+        return
+    backfill_email_lower(db)
+    # Case-insensitive email lookups use the normalized copy of the email
+    try:
+        db.customers.create_index([("email_lower", 1)], unique=True)
+    except OperationFailure as e:
+        if e.code != 11000:
+            raise
+        report_email_case_collisions(db)
+        raise
+    # Backs the DuplicateKeyError (409) branch in create_customer
+    db.customers.create_index([("email", 1)], unique=True)
+    db.customers.create_index([("phone", 1)], unique=True)
+    # Multikey index for the embedded address lookup in get_address_by_id
+    db.customers.create_index([("addresses._id", 1)])
+    _indexes_created = True
+
+def backfill_email_lower(db):
+    """
+    Populates email_lower on customers created before it existed.
+    Without it the unique index would see every legacy customer as
+    null (and fail to build), and ?email= would never match them.
+    """
+    db.customers.update_many(
+        {"email_lower": {"$exists": False}},
+        [{"$set": {"email_lower": {"$toLower": {"$trim": {"input": "$email"}}}}}]
+    )
+
+def report_email_case_collisions(db):
+    """
+    Logs existing emails that differ only by case. Emails are unique
+    regardless of case, so these customers have to be merged or
+    corrected by hand before the email_lower index can be built.
+    """
+    collisions = db.customers.aggregate([
+        {"$group": {"_id": "$email_lower", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": 10}
+    ])
+    log.critical("email_case_collisions", emails=[c["_id"] for c in collisions])
+
 def get_db():
     """
-    Gets the db instance (database) for the current request.
-    Stores it in the Flask 'g' (global) context.
+    Gets the db instance (database).
+    The handle is shared by every request in the process;
+    the client's connection pool does the per-request work.
+    """
+    if _db is None:
+        get_db_client()
+    return _db
+
+def get_customers_fast():
+    """
+    Gets the customers collection with FAST_WRITE_CONCERN,
+    for writes that are cheap to retry.
+    """
+    if _customers_fast is None:
+        get_db_client()
+    return _customers_fast
+
+def get_customers_durable():
+    """
+    Gets the customers collection with DURABLE_WRITE_CONCERN.
     """
-    if 'db' not in g:
-        db_name = os.environ.get('DB_NAME', 'customer_db')
-        g.db = get_db_client()[db_name]
-    return g.db
+    if _customers_durable is None:
+        get_db_client()
+    return _customers_durable
 
 def close_db(e=None):
     """
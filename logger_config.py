@@ -1,9 +1,11 @@
+import atexit
 import logging
+import queue
 import sys
 import structlog
-from flask import request
 import os
 from enum import IntEnum
+from logging.handlers import QueueHandler, QueueListener
 
 
 from opentelemetry.sdk._logs import LoggerProvider, LogRecord
@@ -41,7 +43,7 @@ class SeverityNumber(IntEnum):
     FATAL4 = 24
 
 
-PII_FIELDS = {'email', 'phone', 'line1'}
+PII_FIELDS = frozenset({'email', 'phone', 'line1'})
 SEVERITY_NUMBER_MAP = {
     logging.CRITICAL: SeverityNumber.FATAL,
     logging.ERROR: SeverityNumber.ERROR,
@@ -57,9 +59,8 @@ def mask_pii_processor(logger, log_method_name, event_dict):
     for field_name in ['request_body', 'response_body']:
         body = event_dict.get(field_name)
         if isinstance(body, dict):
-            for key in PII_FIELDS:
-                if key in body:
-                    body[key] = "REDACTED"
+            for key in body.keys() & PII_FIELDS:
+                body[key] = "REDACTED"
     return event_dict
 
 
@@ -105,6 +106,17 @@ class OTLPHandler(logging.Handler):
 
 
 
+class LocalQueueHandler(QueueHandler):
+    """
+    Enqueues records as-is for the in-process QueueListener.
+    The default prepare() pre-formats the record, which would turn
+    structlog's event dict into a plain string before the
+    ProcessorFormatter on the console handler can render it.
+    """
+    def prepare(self, record):
+        return record
+
+
 def setup_logging(log_level="INFO"):
     """Configure structlog + OpenTelemetry logging."""
     loki_otlp_url = os.environ.get("LOKI_OTLP_URL", "http://loki:4318/v1/logs")
@@ -122,12 +134,11 @@ def setup_logging(log_level="INFO"):
     # Structlog setup
     structlog.configure(
         processors=[
+            # correlation_id/path/method are bound per request in before_request
+            structlog.contextvars.merge_contextvars,
             structlog.stdlib.add_logger_name,
             structlog.stdlib.add_log_level,
             structlog.processors.TimeStamper(fmt="iso"),
-            lambda _, __, ed: {
-                'correlation_id': request.headers.get('X-Correlation-Id')
-            } if request else {},
             mask_pii_processor,
             structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
         ],
@@ -150,11 +161,17 @@ def setup_logging(log_level="INFO"):
     root_logger = logging.getLogger()
     root_log_level = logging.getLevelName(log_level.upper())
 
-    root_logger.addHandler(console_handler)
-    root_logger.addHandler(otlp_handler)
+    # Request threads only enqueue records; formatting and I/O for both
+    # handlers run on the listener's background thread.
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, console_handler, otlp_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root_logger.addHandler(LocalQueueHandler(log_queue))
     root_logger.setLevel(root_log_level)
 
     logging.getLogger("werkzeug").setLevel(logging.WARNING)
     logging.getLogger("opentelemetry").setLevel(logging.WARNING)
 
-    print(f"✅ Structured logging configured (Console + OTLP to {loki_otlp_url})")
+    structlog.get_logger().info("logging_configured", otlp_endpoint=loki_otlp_url)
@@ -0,0 +1,34 @@
+import fastjsonschema
+from errors import ApiError
+
+# Compiled once at import; fastjsonschema generates a Python validator per schema.
+validate_customer = fastjsonschema.compile({
+    "type": "object",
+    "required": ["name", "email", "phone"],
+    "properties": {
+        "name": {"type": "string", "minLength": 1},
+        "email": {"type": "string", "minLength": 1},
+        "phone": {"type": "string", "minLength": 1}
+    },
+    "additionalProperties": False
+})
+
+validate_address = fastjsonschema.compile({
+    "type": "object",
+    "required": ["line1", "city", "pincode"],
+    "properties": {
+        "line1": {"type": "string", "minLength": 1},
+        "area": {"type": ["string", "null"]},
+        "city": {"type": "string", "minLength": 1},
+        "pincode": {"type": "string", "minLength": 1}
+    },
+    "additionalProperties": False
+})
+
+
+def validate(validator, data):
+    """Runs a compiled validator, turning failures into a 400 ApiError."""
+    try:
+        validator(data)
+    except fastjsonschema.JsonSchemaException as e:
+        raise ApiError(e.message, 400, "BAD_REQUEST")
\ No newline at end of file
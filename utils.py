@@ -1,7 +1,12 @@
 import json
+import orjson
+from functools import wraps
 from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime
+from flask import current_app
 from flask.json.provider import JSONProvider
+from errors import ApiError
 
 class MongoJSONEncoder(json.JSONEncoder):
     """
@@ -14,12 +19,55 @@ class MongoJSONEncoder(json.JSONEncoder):
             return obj.isoformat()
         return super(MongoJSONEncoder, self).default(obj)
 
+def orjson_default(obj):
+    """
+    Fallback for types orjson can't serialize natively.
+    datetime is handled by orjson itself, so only ObjectId lands here.
+    """
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps_bytes(obj):
+    """
+    Serializes obj straight to UTF-8 JSON bytes with orjson.
+    """
+    return orjson.dumps(obj, default=orjson_default, option=orjson.OPT_NAIVE_UTC)
+
+def json_response(obj, status=200):
+    """
+    Builds a JSON response from pre-encoded bytes, skipping
+    jsonify's argument handling and the bytes -> str -> bytes trip.
+    """
+    return current_app.response_class(dumps_bytes(obj), status=status, mimetype='application/json')
+
 class MongoJSONProvider(JSONProvider):
     """
-    Custom JSON provider for Flask to use our encoder.
+    Custom JSON provider for Flask using orjson.
+    Falls back to the stdlib encoder when json.dumps options are passed.
     """
     def dumps(self, obj, **kwargs):
-        return json.dumps(obj, **kwargs, cls=MongoJSONEncoder)
+        if kwargs:
+            return json.dumps(obj, **kwargs, cls=MongoJSONEncoder)
+        return dumps_bytes(obj).decode()
 
     def loads(self, s, **kwargs):
-        return json.loads(s, **kwargs)
\ No newline at end of file
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
+
+def with_object_id(arg_name):
+    """
+    Route decorator that parses the `arg_name` URL parameter into an
+    ObjectId before calling the handler, or raises a 400 ApiError.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(**kwargs):
+            try:
+                kwargs[arg_name] = ObjectId(kwargs[arg_name])
+            except InvalidId:
+                raise ApiError(f"Invalid {arg_name} format", 400, "BAD_REQUEST")
+            return fn(**kwargs)
+        return wrapper
+    return decorator
\ No newline at end of file